@@ -9,17 +9,14 @@ from typing import Any
 import voluptuous as vol
 
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import Platform
 from homeassistant.core import HomeAssistant
 from homeassistant.helpers.typing import ConfigType
 
-from .const import DOMAIN
+from .const import CONF_RESOURCE_ID, DOMAIN, PLATFORMS
 from .api import OpenDataBolzanoApiClient
 
 _LOGGER = logging.getLogger(__name__)
 
-PLATFORMS: list[Platform] = [Platform.SENSOR, Platform.DEVICE_TRACKER]
-
 CONFIG_SCHEMA = vol.Schema(
     {
         DOMAIN: vol.Schema({})
@@ -36,24 +33,53 @@ async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     return True
 
 
+async def async_migrate_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    """Migrate an old config entry."""
+    _LOGGER.debug("Migrating entry %s from version %s", entry.entry_id, entry.version)
+
+    if entry.version > 2:
+        return False
+
+    if entry.version == 1:
+        data = dict(entry.data)
+        # La versione 1 salvava righe e risorse complete: restano solo nomi e indici
+        resources = data.pop("resources", None) or []
+        rows_data = data.pop("rows_data", None) or []
+
+        if "resource_name" not in data:
+            resource = next((r for r in resources
+                             if r.get("id") == data.get(CONF_RESOURCE_ID)), None)
+            if resource is not None:
+                data["resource_name"] = resource.get("name", "")
+
+        selected_rows = data.get("selected_rows", [])
+        if "selected_row_names" not in data and all(
+                idx < len(rows_data) for idx in selected_rows):
+            data["selected_row_names"] = [
+                rows_data[idx].get("name") or f"row_{idx}" for idx in selected_rows
+            ]
+
+        hass.config_entries.async_update_entry(entry, data=data, version=2)
+
+    _LOGGER.debug("Migration of entry %s to version %s successful",
+                  entry.entry_id, entry.version)
+    return True
+
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up OpenData Provincia Bolzano from a config entry."""
     hass.data.setdefault(DOMAIN, {})
 
-    _LOGGER.debug("Setting up entry with data: %s", dict(entry.data))
+    _LOGGER.debug("Setting up entry %s", entry.entry_id)
 
     # Get all data from entry
-    config_data = dict(entry.data)
-    rows_data = config_data.get("rows_data", [])
-    resources = config_data.get("resources", [])
+    config_data = entry.data
 
     api = OpenDataBolzanoApiClient(hass)
 
     hass.data[DOMAIN][entry.entry_id] = {
         "api": api,
         "config": config_data,
-        "rows_data": rows_data,
-        "resources": resources
     }
 
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
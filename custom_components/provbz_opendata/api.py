@@ -5,55 +5,324 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import random
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from types import MappingProxyType
 from typing import Any
 
 import aiohttp
-import async_timeout
+from yarl import URL
 
 from homeassistant.core import HomeAssistant
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.exceptions import HomeAssistantError
-
-from .const import BASE_API_URL
+from homeassistant.util.json import JSON_DECODE_EXCEPTIONS, json_loads
+
+from .const import (
+    BASE_API_URL,
+    CACHE_MAX_ENTRIES,
+    CACHE_TTL,
+    CACHE_TTL_DETAILS,
+    CACHE_TTL_GROUPS,
+    JSON_EXECUTOR_THRESHOLD,
+    MAX_CONCURRENT_PER_HOST,
+    MAX_RETRIES,
+    MAX_RETRY_DELAY,
+    MAX_CONCURRENT_REQUESTS,
+    MAX_RESPONSE_BYTES,
+    STREAM_CHUNK_SIZE,
+    WFS_MAX_FEATURES,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
+# Parametri statici delle richieste OGC, sovrascritti solo per i valori variabili
+_WMS_GFI_PARAMS = MappingProxyType({
+    "SERVICE": "WMS",
+    "VERSION": "1.3.0",
+    "REQUEST": "GetFeatureInfo",
+    "INFO_FORMAT": "application/json",
+    "FEATURE_COUNT": "100",
+    "WIDTH": "2048",
+    "HEIGHT": "2048",
+    "CRS": "EPSG:4326",
+    "I": "1024",
+    "J": "1024",
+    "EXCEPTIONS": "application/json",
+    "STYLES": "",
+    "FORMAT": "image/png",
+    "TRANSPARENT": "TRUE",
+})
+
+_WMS_MAP_PARAMS = MappingProxyType({
+    "SERVICE": "WMS",
+    "VERSION": "1.3.0",
+    "REQUEST": "GetMap",
+    "STYLES": "",
+    "CRS": "EPSG:4326",
+    "WIDTH": "1024",
+    "HEIGHT": "1024",
+    "FORMAT": "image/png",
+    "TRANSPARENT": "TRUE",
+})
+
+_WFS_PARAMS = MappingProxyType({
+    "SERVICE": "WFS",
+    "VERSION": "2.0.0",
+    "REQUEST": "GetFeature",
+    "OUTPUTFORMAT": "application/json",
+    "SRSNAME": "EPSG:4326",
+})
+
+_WFS_JSON_OVERRIDE = (("REQUEST", "GetFeature"), ("OUTPUTFORMAT", "application/json"))
+_WFS_JSON_OVERRIDE_KEYS = frozenset(name for name, _ in _WFS_JSON_OVERRIDE)
+
+
+def _is_wfs_url(url: str) -> bool:
+    """Return True if the URL query targets a WFS service or GetFeature request."""
+    for name, value in URL(url, encoded=True).query.items():
+        name = name.upper()
+        value = value.upper()
+        if (name == "SERVICE" and value == "WFS") or (name == "REQUEST" and value == "GETFEATURE"):
+            return True
+    return False
+
+
+def _wfs_json_url(url: str) -> str:
+    """Return a WFS URL forced to answer GetFeature requests in JSON.
+
+    Existing REQUEST/OUTPUTFORMAT keys are replaced whatever their case, while
+    repeated keys such as TYPENAMES are preserved.
+    """
+    parsed = URL(url, encoded=True)
+    query = [
+        (name, value) for name, value in parsed.query.items()
+        if name.upper() not in _WFS_JSON_OVERRIDE_KEYS
+    ]
+    return str(parsed.with_query([*query, *_WFS_JSON_OVERRIDE]))
+
 
 class CannotConnect(HomeAssistantError):
     """Error to indicate we cannot connect."""
 
 
+class ResponseTooLarge(CannotConnect):
+    """Error to indicate a response exceeds the configured size limit."""
+
+
+# Errori attesi da una richiesta HTTP; gli altri sono bug e devono propagarsi
+_REQUEST_ERRORS = (
+    aiohttp.ClientError,
+    asyncio.TimeoutError,
+    CannotConnect,
+    *JSON_DECODE_EXCEPTIONS,
+)
+
+
+async def _read_limited(
+    response: aiohttp.ClientResponse, limit: int = MAX_RESPONSE_BYTES
+) -> bytearray:
+    """Read a response body in chunks, failing fast above the size limit.
+
+    The buffer is returned as is (orjson parses it directly) so the body is
+    never held twice in memory.
+    """
+    if (response.content_length or 0) > limit:
+        raise ResponseTooLarge(
+            f"Response of {response.content_length} bytes exceeds limit of {limit}")
+    buf = bytearray()
+    async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+        buf += chunk
+        if len(buf) > limit:
+            raise ResponseTooLarge(f"Response exceeds limit of {limit} bytes")
+    return buf
+
+
+def _retry_delay(response: aiohttp.ClientResponse, attempt: int) -> float:
+    """Return the wait before retrying a throttled request, honouring Retry-After."""
+    retry_after = response.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return min(MAX_RETRY_DELAY, int(retry_after))
+    return min(MAX_RETRY_DELAY, 2 ** attempt) + random.random()
+
+
 class OpenDataBolzanoApiClient:
     """API client for OpenData Provincia Bolzano."""
 
-    def __init__(self, hass: HomeAssistant) -> None:
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        cache_ttl: float = CACHE_TTL,
+    ) -> None:
         """Initialize the client."""
         self._hass = hass
-        self._session = async_get_clientsession(hass)
-
-    async def _api_call(self, endpoint: str, params: dict | None = None) -> Any:
+        self._session: aiohttp.ClientSession | None = None
+        self._cache_ttl = cache_ttl
+        # key -> (timestamp, etag, last_modified, parsed result)
+        self._cache: OrderedDict[tuple, tuple[float, str | None, str | None, Any]] = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Return the shared HTTP session, resolving it on first use."""
+        if self._session is None:
+            self._session = async_get_clientsession(self._hass)
+        return self._session
+
+    @asynccontextmanager
+    async def _request(
+        self, url: str, timeout: float = 30, **kwargs: Any
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """Perform a GET, throttled per host and retried on 429/503 with backoff.
+
+        The timeout applies to each attempt (body included), not to the backoff.
+        """
+        host = URL(url).host or ""
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._host_semaphores[host] = asyncio.Semaphore(
+                MAX_CONCURRENT_PER_HOST)
+        async with semaphore:
+            attempt = 0
+            while True:
+                response = await self.session.get(
+                    url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs)
+                if response.status not in (429, 503) or attempt >= MAX_RETRIES:
+                    break
+                delay = _retry_delay(response, attempt)
+                response.release()
+                _LOGGER.debug(
+                    "%s answered %d, retrying in %.1f s", host, response.status, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+            try:
+                yield response
+            finally:
+                response.release()
+
+    async def _json(self, raw: bytes | bytearray) -> Any:
+        """Decode a JSON body, off the event loop when it is large."""
+        if len(raw) > JSON_EXECUTOR_THRESHOLD:
+            return await self._hass.async_add_executor_job(json_loads, raw)
+        return json_loads(raw)
+
+    async def _limited(self, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Run a request while holding the concurrency semaphore."""
+        async with self._semaphore:
+            return await fetch()
+
+    async def _single_flight(self, key: tuple, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Share one in-flight request between concurrent identical callers."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._hass.async_create_task(self._limited(fetch))
+            self._inflight[key] = task
+
+            def _done(finished: asyncio.Task) -> None:
+                if self._inflight.get(key) is finished:
+                    del self._inflight[key]
+
+            task.add_done_callback(_done)
+        else:
+            _LOGGER.debug("Joining in-flight request for %s", key[0])
+        # Shield so a cancelled caller does not cancel the shared request
+        return await asyncio.shield(task)
+
+    def _cache_get(self, key: tuple) -> tuple[float, str | None, str | None, Any] | None:
+        """Return a cached entry, marking it as recently used."""
+        entry = self._cache.get(key)
+        if entry is not None:
+            self._cache.move_to_end(key)
+        return entry
+
+    def _cache_fresh(self, entry: tuple | None, ttl: float | None = None) -> bool:
+        """Return True if a cached entry is still within its TTL."""
+        if ttl is None:
+            ttl = self._cache_ttl
+        return entry is not None and time.monotonic() - entry[0] < ttl
+
+    def invalidate(self, endpoint: str | None = None) -> None:
+        """Drop cached results, for a single endpoint or URL or all of them."""
+        if endpoint is None:
+            self._cache.clear()
+            return
+        for key in [key for key in self._cache if key[0] == endpoint]:
+            del self._cache[key]
+
+    def _cache_set(self, key: tuple, etag: str | None, last_modified: str | None, value: Any) -> None:
+        """Store a parsed result, evicting the least recently used entries."""
+        self._cache[key] = (time.monotonic(), etag, last_modified, value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > CACHE_MAX_ENTRIES:
+            self._cache.popitem(last=False)
+
+    def _cache_store(self, key: tuple, response: aiohttp.ClientResponse, value: Any) -> None:
+        """Store a parsed result along with the response validators."""
+        self._cache_set(key, response.headers.get("ETag"),
+                        response.headers.get("Last-Modified"), value)
+
+    def _cache_revalidated(self, key: tuple, entry: tuple) -> Any:
+        """Refresh a cached entry after a 304 and return its value."""
+        self._cache_set(key, entry[1], entry[2], entry[3])
+        return entry[3]
+
+    @staticmethod
+    def _conditional_headers(entry: tuple | None) -> dict[str, str]:
+        """Build conditional GET headers from a cached entry."""
+        headers = {}
+        if entry is not None:
+            if entry[1]:
+                headers["If-None-Match"] = entry[1]
+            if entry[2]:
+                headers["If-Modified-Since"] = entry[2]
+        return headers
+
+    async def _api_call(
+        self, endpoint: str, params: dict | None = None, ttl: float | None = None
+    ) -> Any:
         """Make an API call."""
+        key = (endpoint, tuple(sorted((params or {}).items())))
+        cached = self._cache_get(key)
+        if self._cache_fresh(cached, ttl):
+            _LOGGER.debug("Cache hit for %s with params %s", endpoint, params)
+            return cached[3]
+        return await self._single_flight(
+            key, lambda: self._fetch_api_call(endpoint, params, key))
+
+    async def _fetch_api_call(self, endpoint: str, params: dict | None, key: tuple) -> Any:
+        """Perform an API call, revalidating any cached result."""
         url = f"{BASE_API_URL}/{endpoint}"
+        cached = self._cache_get(key)
 
         try:
-            async with async_timeout.timeout(120):
+            _LOGGER.debug(
+                "Making API call to %s with params %s", url, params)
+            async with self._request(
+                url, timeout=120, params=params, headers=self._conditional_headers(cached)
+            ) as response:
+                if response.status == 304 and cached is not None:
+                    _LOGGER.debug("%s not modified, using cached data", url)
+                    return self._cache_revalidated(key, cached)
+                response.raise_for_status()
+                data = await self._json(await _read_limited(response))
+
+                if data.get("success") is False:
+                    error_msg = data.get("error", {}).get(
+                        "message", "Unknown error")
+                    _LOGGER.error("API error for %s: %s",
+                                  endpoint, error_msg)
+                    raise CannotConnect
+
+                result = data.get("result")
                 _LOGGER.debug(
-                    "Making API call to %s with params %s", url, params)
-                async with self._session.get(url, params=params) as response:
-                    response.raise_for_status()
-                    data = await response.json()
-
-                    if data.get("success") is False:
-                        error_msg = data.get("error", {}).get(
-                            "message", "Unknown error")
-                        _LOGGER.error("API error for %s: %s",
-                                      endpoint, error_msg)
-                        raise CannotConnect
-
-                    result = data.get("result")
-                    _LOGGER.debug(
-                        "API call successful, received data: %s", result)
-                    return result
+                    "API call to %s successful (%d bytes)", endpoint, response.content_length or 0)
+                self._cache_store(key, response, result)
+                return result
 
         except aiohttp.ClientError as err:
             _LOGGER.error("Error connecting to API: %s", err)
@@ -61,29 +330,32 @@ class OpenDataBolzanoApiClient:
         except asyncio.TimeoutError as err:
             _LOGGER.error("Timeout connecting to API: %s", err)
             raise CannotConnect from err
-        except Exception as err:
-            _LOGGER.error("Unexpected error in API call: %s", err)
-            raise CannotConnect from err
+        except JSON_DECODE_EXCEPTIONS as err:
+            _LOGGER.error("Invalid JSON received from API: %s", err)
+            raise CannotConnect("Invalid JSON response") from err
 
     async def get_groups(self) -> list[dict[str, Any]]:
         """Get list of available groups."""
-        return await self._api_call("group_list", {"all_fields": "true"})
+        return await self._api_call(
+            "group_list", {"all_fields": "true"}, ttl=CACHE_TTL_GROUPS)
 
     async def get_group_details(self, group_id: str) -> dict[str, Any]:
         """Get details for a specific group."""
         _LOGGER.debug("Getting details for group: %s", group_id)
-        return await self._api_call("group_show", {"id": group_id, "include_datasets": "true"})
+        return await self._api_call(
+            "group_show", {"id": group_id, "include_datasets": "true"}, ttl=CACHE_TTL_DETAILS)
 
     async def get_package_details(self, package_id: str) -> dict[str, Any]:
         """Get details for a specific package."""
-        return await self._api_call("package_show", {"id": package_id})
+        return await self._api_call(
+            "package_show", {"id": package_id}, ttl=CACHE_TTL_DETAILS)
 
     async def get_group_packages(self, group_id: str) -> list[dict[str, Any]]:
         """Get list of packages in a group."""
         try:
             _LOGGER.debug("Fetching packages for group: %s", group_id)
             group_data = await self.get_group_details(group_id)
-            _LOGGER.debug("Group data received: %s", group_data)
+            _LOGGER.debug("Group data received for group %s", group_id)
 
             packages = group_data.get("packages", [])
             _LOGGER.debug("Retrieved %d packages for group %s",
@@ -95,34 +367,60 @@ class OpenDataBolzanoApiClient:
 
     async def get_resource_data(self, url: str) -> dict[str, Any] | list[dict[str, Any]]:
         """Get data from a resource URL."""
+        key = (url, ())
+        cached = self._cache_get(key)
+        if self._cache_fresh(cached):
+            _LOGGER.debug("Cache hit for resource URL: %s", url)
+            return cached[3]
+        return await self._single_flight(
+            key, lambda: self._fetch_resource_data(url, key))
+
+    async def _fetch_resource_data(
+        self, url: str, key: tuple
+    ) -> dict[str, Any] | list[dict[str, Any]]:
+        """Fetch data from a resource URL, revalidating any cached result."""
+        cached = self._cache_get(key)
+
+        # Gli URL WFS vengono richiesti subito in JSON, evitando il doppio giro XML
+        is_wfs = _is_wfs_url(url)
+        fetch_url = _wfs_json_url(url) if is_wfs else url
+
         try:
-            async with async_timeout.timeout(10):
-                _LOGGER.debug("Fetching resource data from URL: %s", url)
-                async with self._session.get(url) as response:
-                    response.raise_for_status()
-
-                    content_type = response.headers.get('Content-Type', '')
-                    if 'xml' in content_type.lower():
-                        _LOGGER.debug("XML response detected, parsing as WFS")
-                        # Per WFS, modifica l'URL per richiedere JSON
-                        url_parts = list(urlparse(url))
-                        query = dict(parse_qs(url_parts[4]))
-                        query.update({
-                            'REQUEST': 'GetFeature',
-                            'OUTPUTFORMAT': 'application/json'
-                        })
-                        url_parts[4] = urlencode(query, True)
-                        new_url = urlunparse(url_parts)
-
-                        # Fai una nuova richiesta per il JSON
-                        async with self._session.get(new_url) as json_response:
-                            json_response.raise_for_status()
-                            data = await json_response.json()
-                            return data.get('features', [])
-                    else:
-                        data = await response.json()
-                        _LOGGER.debug("Resource data retrieved successfully")
-                        return data
+            _LOGGER.debug("Fetching resource data from URL: %s", fetch_url)
+            async with self._request(
+                fetch_url, timeout=10, headers=self._conditional_headers(cached)
+            ) as response:
+                if response.status == 304 and cached is not None:
+                    _LOGGER.debug("Resource not modified, using cached data")
+                    return self._cache_revalidated(key, cached)
+                response.raise_for_status()
+
+                # aiohttp già normalizza in minuscolo e senza parametri
+                if is_wfs:
+                    if 'xml' in response.content_type:
+                        raise CannotConnect(
+                            f"WFS server did not return JSON for {fetch_url}")
+                    data = await self._json(await _read_limited(response))
+                    features = data.get('features', [])
+                    self._cache_store(key, response, features)
+                    return features
+                if 'xml' not in response.content_type:
+                    data = await self._json(await _read_limited(response))
+                    _LOGGER.debug("Resource data retrieved successfully")
+                    self._cache_store(key, response, data)
+                    return data
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+
+            _LOGGER.debug("XML response detected, parsing as WFS")
+            # Per WFS, modifica l'URL per richiedere JSON; la prima risposta
+            # è già rilasciata così da non occupare due slot dello stesso host
+            async with self._request(_wfs_json_url(url), timeout=10) as json_response:
+                json_response.raise_for_status()
+                data = await self._json(await _read_limited(json_response))
+                features = data.get('features', [])
+                self._cache_set(key, etag, last_modified, features)
+                return features
 
         except aiohttp.ClientError as err:
             _LOGGER.error("Error fetching resource data: %s", err)
@@ -130,103 +428,126 @@ class OpenDataBolzanoApiClient:
         except asyncio.TimeoutError as err:
             _LOGGER.error("Timeout fetching resource data: %s", err)
             raise CannotConnect from err
-        except Exception as err:
-            _LOGGER.error("Unexpected error fetching resource data: %s", err)
-            raise CannotConnect from err
+        except JSON_DECODE_EXCEPTIONS as err:
+            _LOGGER.error("Invalid JSON in resource data: %s", err)
+            raise CannotConnect("Invalid JSON response") from err
 
     async def get_feature_info(self, wms_url: str, layer_name: str, bbox: str) -> list:
         """Get feature info from WMS."""
         params = {
-            "SERVICE": "WMS",
-            "VERSION": "1.3.0",
-            "REQUEST": "GetFeatureInfo",
+            **_WMS_GFI_PARAMS,
             "LAYERS": layer_name,
             "QUERY_LAYERS": layer_name,
-            "INFO_FORMAT": "application/json",
-            "FEATURE_COUNT": "100",
             "BBOX": bbox,
-            "WIDTH": "2048",
-            "HEIGHT": "2048",
-            "CRS": "EPSG:4326",
-            "I": "1024",
-            "J": "1024",
-            "EXCEPTIONS": "application/json",
-            "STYLES": "",
-            "FORMAT": "image/png",
-            "TRANSPARENT": "TRUE"
         }
+        key = (wms_url, tuple(sorted(params.items())))
+        cached = self._cache_get(key)
+        if self._cache_fresh(cached):
+            _LOGGER.debug("Cache hit for WMS layer %s", layer_name)
+            return cached[3]
+        return await self._single_flight(
+            key, lambda: self._fetch_feature_info(wms_url, layer_name, params, key))
+
+    async def _fetch_feature_info(
+        self, wms_url: str, layer_name: str, params: dict[str, str], key: tuple
+    ) -> list:
+        """Fetch feature info from WMS, revalidating any cached result."""
+        cached = self._cache_get(key)
 
         try:
-            async with async_timeout.timeout(30):
-                _LOGGER.debug(
-                    "WMS GetFeatureInfo request to URL: %s with params: %s", wms_url, params)
-                async with self._session.get(wms_url, params=params) as response:
-                    response.raise_for_status()
-                    content_type = response.headers.get("Content-Type", "")
-
-                    if "application/json" in content_type:
-                        data = await response.json()
-                        _LOGGER.debug("Received JSON response: %s", data)
-                        return data.get("features", [])
-                    else:
-                        text = await response.text()
-                        _LOGGER.error(
-                            "Unexpected response type: %s, content: %s", content_type, text[:200])
-                        return []
-
-        except Exception as err:
+            _LOGGER.debug(
+                "WMS GetFeatureInfo request to URL: %s with params: %s", wms_url, params)
+            async with self._request(
+                wms_url, timeout=30, params=params, headers=self._conditional_headers(cached)
+            ) as response:
+                if response.status == 304 and cached is not None:
+                    _LOGGER.debug("WMS layer %s not modified", layer_name)
+                    return self._cache_revalidated(key, cached)
+                response.raise_for_status()
+                content_type = response.content_type
+
+                if content_type == "application/json":
+                    data = await self._json(await _read_limited(response))
+                    features = data.get("features", [])
+                    _LOGGER.debug("Received %d WMS features", len(features))
+                    self._cache_store(key, response, features)
+                    return features
+                else:
+                    body = await _read_limited(response)
+                    _LOGGER.error(
+                        "Unexpected response type: %s, content: %s",
+                        content_type, body[:200].decode(errors="replace"))
+                    return []
+
+        except _REQUEST_ERRORS as err:
             _LOGGER.error("Error getting WMS feature info: %s", err)
             _LOGGER.debug("URL was: %s", wms_url)
             return []
 
-    async def get_wfs_features(self, wfs_url: str, layer_name: str) -> list:
+    async def get_wfs_features(
+        self, wfs_url: str, layer_name: str, max_features: int = WFS_MAX_FEATURES
+    ) -> list:
         """Get features from WFS."""
         params = {
-            "SERVICE": "WFS",
-            "VERSION": "2.0.0",
-            "REQUEST": "GetFeature",
+            **_WFS_PARAMS,
             "TYPENAME": layer_name,
-            "OUTPUTFORMAT": "application/json",
-            "SRSNAME": "EPSG:4326",
-            "COUNT": "1000"  # Limita il numero di feature per prestazioni
+            "COUNT": str(max_features)  # Limita il numero di feature per prestazioni
         }
+        key = (wfs_url, tuple(sorted(params.items())))
+        cached = self._cache_get(key)
+        if self._cache_fresh(cached):
+            _LOGGER.debug("Cache hit for WFS layer %s", layer_name)
+            return cached[3]
+        return await self._single_flight(
+            key, lambda: self._fetch_wfs_features(wfs_url, layer_name, max_features, params, key))
+
+    async def _fetch_wfs_features(
+        self, wfs_url: str, layer_name: str, max_features: int,
+        params: dict[str, str], key: tuple
+    ) -> list:
+        """Fetch features from WFS, revalidating any cached result."""
+        cached = self._cache_get(key)
 
         try:
-            async with async_timeout.timeout(30):
-                _LOGGER.debug(
-                    "WFS request to: %s with params: %s", wfs_url, params)
-                async with self._session.get(wfs_url, params=params) as response:
-                    response.raise_for_status()
-                    data = await response.json()
-                    _LOGGER.debug("WFS response received with %d features",
-                                  len(data.get("features", [])))
-                    return data.get("features", [])
-
-        except Exception as err:
+            _LOGGER.debug(
+                "WFS request to: %s with params: %s", wfs_url, params)
+            async with self._request(
+                wfs_url, timeout=30, params=params, headers=self._conditional_headers(cached)
+            ) as response:
+                if response.status == 304 and cached is not None:
+                    _LOGGER.debug("WFS layer %s not modified", layer_name)
+                    return self._cache_revalidated(key, cached)
+                response.raise_for_status()
+                data = await self._json(await _read_limited(response))
+                features = data.get("features", [])
+                if len(features) > max_features:
+                    _LOGGER.warning(
+                        "WFS layer %s returned %d features, keeping the first %d",
+                        layer_name, len(features), max_features)
+                    features = features[:max_features]
+                _LOGGER.debug("WFS response received with %d features",
+                              len(features))
+                self._cache_store(key, response, features)
+                return features
+
+        except _REQUEST_ERRORS as err:
             _LOGGER.error("Error getting WFS features: %s", err)
             return []
 
     async def get_map(self, wms_url: str, layer_name: str, bbox: str) -> bytes:
         """Get WMS map image."""
         params = {
-            "SERVICE": "WMS",
-            "VERSION": "1.3.0",
-            "REQUEST": "GetMap",
+            **_WMS_MAP_PARAMS,
             "LAYERS": layer_name,
-            "STYLES": "",
-            "CRS": "EPSG:4326",
             "BBOX": bbox,
-            "WIDTH": "1024",
-            "HEIGHT": "1024",
-            "FORMAT": "image/png",
-            "TRANSPARENT": "TRUE"
         }
 
         try:
-            async with async_timeout.timeout(10):
-                async with self._session.get(wms_url, params=params) as response:
-                    response.raise_for_status()
-                    return await response.read()
-        except Exception as err:
+            async with self._request(wms_url, timeout=10, params=params) as response:
+                response.raise_for_status()
+                return bytes(await _read_limited(response))
+        except CannotConnect:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
             _LOGGER.error("Error getting WMS map: %s", err)
             raise CannotConnect from err
@@ -3,9 +3,11 @@ from __future__ import annotations
 
 import logging
 import re
-from typing import Any
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Callable, Iterator
 import voluptuous as vol
-from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+from yarl import URL
 
 from homeassistant import config_entries
 from homeassistant.data_entry_flow import FlowResult
@@ -20,6 +22,8 @@ from .const import (
     CONF_RESOURCE_ID,
     CONF_LANGUAGE,
     SUPPORTED_LANGUAGES,
+    SUPPORTED_FORMATS,
+    MAX_ROW_OPTIONS,
     GROUP_TRANSLATIONS,
     BASE_API_URL,
 )
@@ -27,11 +31,41 @@ from .api import OpenDataBolzanoApiClient, CannotConnect
 
 _LOGGER = logging.getLogger(__name__)
 
+_FORMATO_RE = re.compile(r"\s*\(Formato [^)]+\)")
+_SLUG_RE = re.compile(r'[^a-z0-9_]+')
+_MULTI_UNDERSCORE_RE = re.compile(r'_+')
+
+# Parametri fissi della GetFeature WFS: varia solo TYPENAME
+_WFS_QUERY = MappingProxyType({
+    "SERVICE": "WFS",
+    "VERSION": "2.0.0",
+    "REQUEST": "GetFeature",
+    "OUTPUTFORMAT": "application/json",
+    "SRSNAME": "EPSG:4326",
+})
+
+
+@lru_cache(maxsize=256)
+def _with_lang(url: str, lang: str) -> str:
+    """Return the URL with the lang parameter forced, shared across flows."""
+    return str(URL(url).update_query(lang=lang))
+
+
+@lru_cache(maxsize=512)
+def _clean_resource_name(name: str) -> str:
+    """Return the resource name without the "(Formato ...)" suffix."""
+    return _FORMATO_RE.sub("", name)
+
+
+_LANGUAGE_SCHEMA = vol.Schema({
+    vol.Required(CONF_LANGUAGE): vol.In(SUPPORTED_LANGUAGES)
+})
+
 
 class OpenDataProvinceBolzanoConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Handle a config flow for OpenData Provincia Bolzano integration."""
 
-    VERSION = 1
+    VERSION = 2
     STEPS = ["user", "language", "group", "package",
              "resource", "rows", "fields", "confirm"]
 
@@ -40,21 +74,48 @@ class OpenDataProvinceBolzanoConfigFlow(config_entries.ConfigFlow, domain=DOMAIN
         self._config: dict[str, Any] = {}
         self._groups: list[dict[str, Any]] = []
         self._packages: list[dict[str, Any]] = []
+        self._packages_by_group: dict[str, list[dict[str, Any]]] = {}
         self._resources: list[dict[str, Any]] = []
+        self._resources_by_id: dict[str, dict[str, Any]] = {}
+        self._resource_options: tuple[str, list[dict[str, str]]] | None = None
         self._rows_data: list[dict[str, Any]] = []
+        self._rows_source: str | None = None
+        self._row_name_to_index: dict[str, int] = {}
+        self._field_options: tuple[tuple[Any, int], list[dict[str, str]]] | None = None
         self._current_api_url: str = BASE_API_URL
         self._current_step: int = 0
+        self._client: OpenDataBolzanoApiClient | None = None
+        self._last_schema: tuple[tuple[Any, ...], vol.Schema] | None = None
 
     @property
-    def _api_url(self) -> str:
-        """Return current API URL with forced language parameter."""
-        parsed = urlparse(self._current_api_url)
-        query = parse_qs(parsed.query)
+    def client(self) -> OpenDataBolzanoApiClient:
+        """Return the API client shared by all steps of this flow."""
+        if self._client is None:
+            self._client = OpenDataBolzanoApiClient(self.hass)
+        return self._client
+
+    def _build_url_with_lang(self, url: str, extra_query: dict[str, str] | None = None) -> str:
+        """Return the URL with the chosen language (and extra params) forced."""
         # Forza la lingua scelta dall'utente
         lang = self._config.get(CONF_LANGUAGE, "en").lower()
-        query["lang"] = [lang]
-        new_query = urlencode(query, doseq=True)
-        return urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params, new_query, parsed.fragment))
+        if not extra_query:
+            return _with_lang(url, lang)
+        # Un solo parse anche con i parametri extra (es. WFS)
+        return str(URL(url).update_query({"lang": lang, **extra_query}))
+
+    @property
+    def _api_url(self) -> str:
+        """Return current API URL with forced language parameter."""
+        return _with_lang(
+            self._current_api_url, self._config.get(CONF_LANGUAGE, "en").lower())
+
+    def _schema_for(self, key: tuple[Any, ...], build: Callable[[], vol.Schema]) -> vol.Schema:
+        """Return the form schema, rebuilding it only when step or options change."""
+        # Il form viene ridisegnato con le stesse opzioni quando l'input non è valido
+        cached = self._last_schema
+        if cached is None or cached[0] != key:
+            cached = self._last_schema = (key, build())
+        return cached[1]
 
     def _api_url_link(self) -> str:
         """Return a clickable HTML link for the current API URL."""
@@ -84,9 +145,7 @@ class OpenDataProvinceBolzanoConfigFlow(config_entries.ConfigFlow, domain=DOMAIN
             return await self.async_step_group()
         return self.async_show_form(
             step_id="language",
-            data_schema=vol.Schema({
-                vol.Required(CONF_LANGUAGE): vol.In(SUPPORTED_LANGUAGES)
-            })
+            data_schema=_LANGUAGE_SCHEMA
         )
 
     async def async_step_group(self, user_input: dict[str, Any] | None = None) -> FlowResult:
@@ -94,12 +153,13 @@ class OpenDataProvinceBolzanoConfigFlow(config_entries.ConfigFlow, domain=DOMAIN
         errors = {}
         groups = {}
         try:
-            client = OpenDataBolzanoApiClient(self.hass)
-            self._groups = await client.get_groups()
+            # L'elenco gruppi non dipende da nessuna scelta: basta scaricarlo una volta per flow
+            if not self._groups:
+                self._groups = await self.client.get_groups()
             lang = self._config.get(CONF_LANGUAGE, "en")
+            lang_translations = GROUP_TRANSLATIONS.get(lang, {})
             groups = {
-                group["name"]: GROUP_TRANSLATIONS[lang].get(
-                    group["name"], group["name"])
+                group["name"]: lang_translations.get(group["name"], group["name"])
                 for group in self._groups
             }
             if user_input is not None:
@@ -126,17 +186,19 @@ class OpenDataProvinceBolzanoConfigFlow(config_entries.ConfigFlow, domain=DOMAIN
         errors = {}
         packages = {}
         try:
-            client = OpenDataBolzanoApiClient(self.hass)
             group_id = self._config[CONF_GROUP_ID]
-            self._packages = await client.get_group_packages(group_id)
+            packages_list = self._packages_by_group.get(group_id)
+            if packages_list is None:
+                packages_list = self._packages_by_group[group_id] = (
+                    await self.client.get_group_packages(group_id))
+            self._packages = packages_list
             if not self._packages:
                 errors["base"] = "no_packages"
             else:
-                packages = {
-                    package["id"]: package.get(
-                        "title", package.get("name", package["id"]))
-                    for package in self._packages
-                }
+                packages = {}
+                for package in self._packages:
+                    name = package.get("name", package["id"])
+                    packages[package["id"]] = package.get("title", name)
             if user_input is not None and not errors:
                 self._config.update(user_input)
                 self._current_api_url = f"{BASE_API_URL}/package_show?id={user_input[CONF_PACKAGE_ID]}"
@@ -161,68 +223,54 @@ class OpenDataProvinceBolzanoConfigFlow(config_entries.ConfigFlow, domain=DOMAIN
         errors = {}
         options = []
         try:
-            client = OpenDataBolzanoApiClient(self.hass)
             package_id = self._config[CONF_PACKAGE_ID]
-            package_details = await client.get_package_details(package_id)
-            self._resources = package_details.get("resources", [])
-
-            # Aggiungi prima le risorse selezionabili: JSON e WMS.
-            for resource in self._resources:
-                resource_format = resource.get("format", "").upper()
-                if resource_format in ["JSON", "WFS"]:
-                    resource_name = resource.get("name", resource["id"])
-                    clean_name = re.sub(
-                        r"\s*\(Formato [^)]+\)", "", resource_name)
-                    options.append({
-                        "value": resource["id"],
-                        "label": f"[{resource_format}] {clean_name}"
-                    })
+            # Al ridisegno dopo un errore le opzioni del pacchetto sono già pronte
+            cached = self._resource_options
+            if cached is not None and cached[0] == package_id:
+                options = cached[1]
+            else:
+                package_details = await self.client.get_package_details(package_id)
+                self._resources = package_details.get("resources", [])
+                self._resources_by_id = {}
 
-            # Aggiungi le altre risorse (non selezionabili).
-            for resource in self._resources:
-                resource_format = resource.get("format", "").upper()
-                if resource_format not in ["JSON", "WFS"]:
-                    resource_name = resource.get("name", resource["id"])
-                    clean_name = re.sub(
-                        r"\s*\(Formato [^)]+\)", "", resource_name)
-                    options.append({
-                        "value": f"not_available_{resource['id']}",
-                        "label": f"🚫 [{resource_format}] {clean_name}"
-                    })
+                # Un solo passaggio: prima le risorse selezionabili (JSON e WFS),
+                # poi le altre (non selezionabili).
+                unavailable = []
+                append_available = options.append
+                append_unavailable = unavailable.append
+                for resource in self._resources:
+                    self._resources_by_id[resource["id"]] = resource
+                    resource_format = resource.get("format", "").upper()
+                    clean_name = _clean_resource_name(resource.get("name", resource["id"]))
+                    if resource_format in SUPPORTED_FORMATS:
+                        append_available({
+                            "value": resource["id"],
+                            "label": f"[{resource_format}] {clean_name}"
+                        })
+                    else:
+                        append_unavailable({
+                            "value": f"not_available_{resource['id']}",
+                            "label": f"🚫 [{resource_format}] {clean_name}"
+                        })
+                options.extend(unavailable)
+                self._resource_options = (package_id, options)
 
             if user_input is not None:
                 selected_resource_id = user_input.get(CONF_RESOURCE_ID)
                 if not selected_resource_id.startswith("not_available_"):
                     self._config[CONF_RESOURCE_ID] = selected_resource_id
-                    resource = next(
-                        (r for r in self._resources if r["id"] == selected_resource_id), None)
+                    resource = self._resources_by_id.get(selected_resource_id)
                     if resource and resource.get("url"):
                         self._config["resource_format"] = resource.get(
                             "format", "").upper()
+                        self._config["resource_name"] = resource.get("name", "")
                         # Costruisci l'URL forzando il parametro lang
-                        parsed = urlparse(resource["url"])
-                        query = parse_qs(parsed.query)
-                        query.pop("lang", None)
-                        lang = self._config.get(CONF_LANGUAGE, "en").lower()
-                        query["lang"] = [lang]
+                        extra_query = None
                         if self._config["resource_format"] == "WFS":
-                            query.update({
-                            "SERVICE": ["WFS"],
-                            "VERSION": ["2.0.0"],
-                            "REQUEST": ["GetFeature"],
-                            "OUTPUTFORMAT": ["application/json"],
-                            "TYPENAME": [resource.get("name", "")],
-                            "SRSNAME": ["EPSG:4326"]
-                        })
-                        new_query = urlencode(query, doseq=True)
-                        self._current_api_url = urlunparse((
-                            parsed.scheme,
-                            parsed.netloc,
-                            parsed.path,
-                            parsed.params,
-                            new_query,
-                            parsed.fragment
-                        ))
+                            extra_query = {
+                                **_WFS_QUERY, "TYPENAME": resource.get("name", "")}
+                        self._current_api_url = self._build_url_with_lang(
+                            resource["url"], extra_query)
                         self._config["resource_url"] = self._current_api_url
                         # Se il formato è WMS, salta lo step rows
                         if self._config["resource_format"] == "WFS":
@@ -252,41 +300,44 @@ class OpenDataProvinceBolzanoConfigFlow(config_entries.ConfigFlow, domain=DOMAIN
         """Handle the rows selection step."""
         errors = {}
         row_names = {}
+        free_text = False
         try:
-            client = OpenDataBolzanoApiClient(self.hass)
-            resource = next(
-                (r for r in self._resources if r["id"] == self._config[CONF_RESOURCE_ID]), None)
-            if resource and resource.get("url"):
-                parsed = urlparse(resource["url"])
-                query = parse_qs(parsed.query)
-                query.pop("lang", None)
-                lang = self._config.get(CONF_LANGUAGE, "en").lower()
-                query["lang"] = [lang]
-                new_query = urlencode(query, doseq=True)
-                new_url = urlunparse(
-                    (parsed.scheme, parsed.netloc, parsed.path, parsed.params, new_query, parsed.fragment))
-                json_data = await client.get_resource_data(new_url)
-                if isinstance(json_data, dict) and "rows" in json_data:
-                    self._rows_data = json_data["rows"]
-                elif isinstance(json_data, list):
-                    self._rows_data = json_data
-                else:
-                    self._rows_data = []
-                row_names = {
-                    (row.get("name") or f"row_{idx}"): (row.get("name") or f"row_{idx}")
-                    for idx, row in enumerate(self._rows_data)
-                }
+            # L'URL con la lingua forzata è già stato costruito nello step resource
+            resource_url = self._config.get("resource_url")
+            if resource_url:
+                # Ridisegni dopo un errore e ritorni allo step riusano righe e indice
+                if resource_url != self._rows_source:
+                    json_data = await self.client.get_resource_data(resource_url)
+                    # Caso più comune per primo: la risorsa è già una lista di righe
+                    if isinstance(json_data, list):
+                        self._rows_data = json_data
+                    elif isinstance(json_data, dict):
+                        self._rows_data = json_data.get("rows") or []
+                    else:
+                        self._rows_data = []
+                    # Righe appena scaricate: le opzioni dei campi vanno ricostruite
+                    self._field_options = None
+                    # Un solo passaggio sulle righe: indice nome -> posizione (vince la prima
+                    # occorrenza), usato sia per le opzioni che per la selezione
+                    self._row_name_to_index = {}
+                    for idx, row in enumerate(self._rows_data):
+                        self._row_name_to_index.setdefault(row.get("name") or f"row_{idx}", idx)
+                    self._rows_source = resource_url
+                # Con troppe righe il selettore diventa ingestibile: si chiede il nome
+                free_text = len(self._row_name_to_index) > MAX_ROW_OPTIONS
+                if not free_text:
+                    row_names = {name: name for name in self._row_name_to_index}
                 if user_input is not None:
                     selected_row = user_input.get("row")
                     if selected_row:
-                        selected_index = next(
-                            (idx for idx, row in enumerate(self._rows_data)
-                             if (row.get("name") or f"row_{idx}") == selected_row),
-                            None
-                        )
+                        selected_index = self._row_name_to_index.get(selected_row)
                         if selected_index is not None:
                             self._config["selected_rows"] = [selected_index]
+                            # Identità della riga: l'indice da solo cambia se la risorsa si riordina
+                            self._config["selected_row_names"] = [selected_row]
                             return await self.async_step_fields()
+                        elif free_text:
+                            errors["base"] = "row_not_found"
                         else:
                             errors["base"] = "no_rows_selected"
                     else:
@@ -297,51 +348,69 @@ class OpenDataProvinceBolzanoConfigFlow(config_entries.ConfigFlow, domain=DOMAIN
         except Exception as error:
             _LOGGER.exception("Unexpected exception in rows step: %s", error)
             errors["base"] = "unknown"
+        if free_text:
+            data_schema = self._schema_for(
+                ("rows_text",), lambda: vol.Schema({vol.Required("row"): str}))
+        else:
+            data_schema = self._schema_for(
+                ("rows", *row_names),
+                lambda: vol.Schema({vol.Required("row"): vol.In(row_names)}))
         return self.async_show_form(
-            step_id="rows",
-            data_schema=vol.Schema({vol.Required("row"): vol.In(row_names)}),
+            # Il form a testo libero ha un suo step per avere testi e errori dedicati
+            step_id="row_name" if free_text else "rows",
+            data_schema=data_schema,
             errors=errors if errors else None,
             last_step=False,
             description_placeholders={"api_url": self._api_url_link()}
         )
 
+    async def async_step_row_name(self, user_input: dict[str, Any] | None = None) -> FlowResult:
+        """Handle the row entered by name when there are too many to list."""
+        return await self.async_step_rows(user_input)
+
     async def async_step_fields(self, user_input: dict[str, Any] | None = None) -> FlowResult:
         """Handle the fields selection step."""
         errors = {}
         options = []
         try:
-            if "selected_rows" not in self._config or not self._config["selected_rows"]:
-                first_row = self._rows_data[0]
+            selected_rows = self._config.get("selected_rows")
+            row_idx = selected_rows[0] if selected_rows else 0
+            # La riga non cambia tra un ridisegno e l'altro: le opzioni si riusano
+            options_key = (self._config.get(CONF_RESOURCE_ID), row_idx)
+            cached = self._field_options
+            if cached is not None and cached[0] == options_key:
+                options = cached[1]
             else:
-                first_row = self._rows_data[self._config["selected_rows"][0]]
-            processed_fields = set()
-            # Opzioni per i campi di measurements
-            measurements = first_row.get("measurements", [])
-            if isinstance(measurements, list):
-                for measurement in measurements:
-                    if "description" in measurement and "code" in measurement:
-                        code = measurement["code"].lower()
-                        description = measurement["description"]
-                        value = first_row.get(code, "N/A")
-                        if value == "N/A":
-                            label = f"{code}: {value}"
-                        else:
-                            label = f"{code} ({description}): {value}"
-                        options.append({
-                            "value": f"measurement:{code}",
-                            "label": label
-                        })
-                        processed_fields.add(code)
-            # Opzioni per i campi normali (solo se non già processati in measurements)
-            for field_name, field_value in first_row.items():
-                if field_name == "measurements":
-                    continue
-                if field_name.lower() in processed_fields:
-                    continue
-                options.append({
-                    "value": f"field:{field_name}",
-                    "label": f"{field_name}: {field_value}"
-                })
+                first_row = self._rows_data[row_idx]
+                processed_fields = set()
+                # Opzioni per i campi di measurements
+                measurements = first_row.get("measurements", [])
+                if isinstance(measurements, list):
+                    for measurement in measurements:
+                        if "description" in measurement and "code" in measurement:
+                            code = measurement["code"].lower()
+                            description = measurement["description"]
+                            value = first_row.get(code, "N/A")
+                            if value == "N/A":
+                                label = f"{code}: {value}"
+                            else:
+                                label = f"{code} ({description}): {value}"
+                            options.append({
+                                "value": f"measurement:{code}",
+                                "label": label
+                            })
+                            processed_fields.add(code)
+                # Opzioni per i campi normali (solo se non già processati in measurements);
+                # i valori annidati non possono diventare lo stato di un sensore
+                options.extend(
+                    {"value": f"field:{field_name}", "label": f"{field_name}: {field_value}"}
+                    for field_name, field_value in first_row.items()
+                    if not isinstance(field_value, (dict, list))
+                    and field_name != "measurements"
+                    # Senza measurements non serve normalizzare i nomi
+                    and (not processed_fields or field_name.lower() not in processed_fields)
+                )
+                self._field_options = (options_key, options)
             if user_input is not None:
                 selected = user_input.get("fields", [])
                 selected_fields = []
@@ -361,19 +430,49 @@ class OpenDataProvinceBolzanoConfigFlow(config_entries.ConfigFlow, domain=DOMAIN
             errors["base"] = "unknown"
         return self.async_show_form(
             step_id="fields",
-            data_schema=vol.Schema({
-                vol.Required("fields", default=[]): selector({
-                    "select": {
-                        "multiple": True,
-                        "options": options,
-                        "mode": "dropdown"
-                    }
-                })
-            }),
+            data_schema=self._schema_for(
+                ("fields", *(option["value"] for option in options),
+                 *(option["label"] for option in options)),
+                lambda: vol.Schema({
+                    vol.Required("fields", default=[]): selector({
+                        "select": {
+                            "multiple": True,
+                            "options": options,
+                            "mode": "dropdown"
+                        }
+                    })
+                })),
             errors=errors if errors else None,  # Rimuovi l'errore di default
             description_placeholders={"api_url": self._api_url_link()}
         )
 
+    def _iter_sensor_previews(self) -> Iterator[str]:
+        """Yield the preview line of each sensor the entry will create."""
+        for idx in self._config.get("selected_rows", []):
+            row = self._rows_data[idx]
+            row_name = row.get("name", "row")
+            row_name_clean = _SLUG_RE.sub('_', row_name.lower().strip())
+            # Indice per codice (vince la prima occorrenza, come prima)
+            measurements_by_code = {}
+            for measurement in row.get("measurements", []):
+                measurements_by_code.setdefault(
+                    measurement.get("code", "").lower(), measurement)
+            for field_type, key in self._config["selected_fields"]:
+                key_lower = key.lower()
+                if field_type == "measurement":
+                    measurement = measurements_by_code.get(key_lower)
+                    if measurement and "description" in measurement:
+                        sensor_field = f"{key} ({measurement.get('description', key)})".lower(
+                        ).replace(" ", "_")
+                    else:
+                        sensor_field = key_lower
+                else:
+                    sensor_field = key_lower
+                sensor_field = _MULTI_UNDERSCORE_RE.sub('_', sensor_field).strip('_')
+                entity_id = f"sensor.provbz_{row_name_clean}_{sensor_field}"
+                value = row.get(key, "N/A")
+                yield f"{entity_id}: {value}"
+
     async def async_step_confirm(self, user_input: dict[str, Any] | None = None) -> FlowResult:
         """
         Show the confirmation dialog.
@@ -382,20 +481,11 @@ class OpenDataProvinceBolzanoConfigFlow(config_entries.ConfigFlow, domain=DOMAIN
         I testi fissi devono essere gestiti tramite i file di traduzione.
         """
         if user_input is not None:
-            self.hass.data.setdefault(DOMAIN, {})
             config_data = dict(self._config)
-            config_data["rows_data"] = self._rows_data
-            config_data["resources"] = self._resources
             config_data["unique_id"] = self.flow_id
 
-            resource = next((r for r in self._resources if r["id"] == self._config[CONF_RESOURCE_ID]), None)
+            resource = self._resources_by_id.get(self._config[CONF_RESOURCE_ID])
             
-            self.hass.data[DOMAIN][self.flow_id] = {
-                "api": OpenDataBolzanoApiClient(self.hass),
-                "config": config_data,
-                "rows_data": self._rows_data,
-                "resources": self._resources
-            }
             return self.async_create_entry(
                 title=resource.get("name", NAME),  # Usa il nome della risorsa
                 data=config_data
@@ -403,27 +493,7 @@ class OpenDataProvinceBolzanoConfigFlow(config_entries.ConfigFlow, domain=DOMAIN
         if self._config.get("resource_format", "").upper() == "WMS":
             preview_text = "Tracker per il layer WMS verrà creato."
         else:
-            sensor_previews = []
-            for row in [self._rows_data[idx] for idx in self._config.get("selected_rows", [])]:
-                row_name = row.get("name", "row")
-                row_name_clean = re.sub(
-                    r'[^a-z0-9_]+', '_', row_name.lower().strip())
-                for field_type, key in self._config["selected_fields"]:
-                    if field_type == "measurement":
-                        measurement = next((m for m in row.get("measurements", [])
-                                            if m.get("code", "").lower() == key.lower()), None)
-                        if measurement and "description" in measurement:
-                            sensor_field = f"{key} ({measurement.get('description', key)})".lower(
-                            ).replace(" ", "_")
-                        else:
-                            sensor_field = key.lower()
-                    else:
-                        sensor_field = key.lower()
-                    sensor_field = re.sub(r'_+', '_', sensor_field).strip('_')
-                    entity_id = f"sensor.provbz_{row_name_clean}_{sensor_field}"
-                    value = row.get(key, "N/A")
-                    sensor_previews.append(f"{entity_id}: {value}")
-            preview_text = "\n".join(sensor_previews)
+            preview_text = "\n".join(self._iter_sensor_previews())
         return self.async_show_form(
             step_id="confirm",
             data_schema=vol.Schema({}),
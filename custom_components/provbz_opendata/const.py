@@ -27,12 +27,38 @@ SUPPORTED_LANGUAGES = {
     "rm": "Ladin"
 }
 
+# Resource formats that can be configured
+SUPPORTED_FORMATS: Final = frozenset({"JSON", "WFS"})
+
+# Above this many rows the rows step asks for the name instead of listing them
+MAX_ROW_OPTIONS = 500
+
 # Defaults
 DEFAULT_LANGUAGE = "en"
 
 # Scan interval
 DEFAULT_SCAN_INTERVAL = 300  # 5 minutes
 
+# API response cache
+CACHE_TTL = DEFAULT_SCAN_INTERVAL - 30  # expires before the next scheduled refresh
+CACHE_TTL_GROUPS = 3600  # 1 hour, the group catalog rarely changes
+CACHE_TTL_DETAILS = 600  # 10 minutes
+CACHE_MAX_ENTRIES = 256
+
+# Response size limits
+WFS_MAX_FEATURES = 1000
+MAX_RESPONSE_BYTES = 32 * 1024 * 1024  # 32 MiB
+STREAM_CHUNK_SIZE = 65536
+JSON_EXECUTOR_THRESHOLD = 1024 * 1024  # decode larger bodies in the executor
+
+# Maximum concurrent requests per client
+MAX_CONCURRENT_REQUESTS = 8
+MAX_CONCURRENT_PER_HOST = 4
+
+# Retries for throttled (429/503) responses
+MAX_RETRIES = 3
+MAX_RETRY_DELAY = 30  # seconds
+
 # Icons
 DEFAULT_ICON = "mdi:database"
 
@@ -34,10 +34,8 @@ async def async_setup_entry(
         return
 
     api = entry_data["api"]
-    resource = next((r for r in config.get("resources", [])
-                    if r["id"] == config.get("resource_id")), None)
-
-    if not resource:
+    resource_name = config.get("resource_name")
+    if resource_name is None:
         _LOGGER.error("Resource not found")
         return
 
@@ -46,7 +44,7 @@ async def async_setup_entry(
         try:
             features = await api.get_wfs_features(
                 config["resource_url"],
-                resource.get("name", "")
+                resource_name
             )
 
             if not isinstance(features, list):
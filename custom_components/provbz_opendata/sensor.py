@@ -3,6 +3,7 @@ from __future__ import annotations
 
 import logging
 import re
+from functools import lru_cache
 from typing import Any
 from datetime import timedelta
 
@@ -17,6 +18,7 @@ from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.update_coordinator import (
     CoordinatorEntity,
     DataUpdateCoordinator,
+    UpdateFailed,
 )
 
 from .const import (
@@ -29,6 +31,25 @@ from .api import OpenDataBolzanoApiClient, CannotConnect
 
 _LOGGER = logging.getLogger(__name__)
 
+_SLUG_RE = re.compile(r'[^a-z0-9]+')
+
+
+@lru_cache(maxsize=512)
+def _slugify(text: str) -> str:
+    """Return the entity_id-safe form of a name."""
+    # Un solo passaggio: ogni sequenza di separatori (underscore compresi) diventa "_"
+    return _SLUG_RE.sub('_', text.lower().strip()).strip('_')
+
+
+def _find_row(rows: list[dict], row_key: str, hint: int) -> int | None:
+    """Return the index of the row named row_key, trying hint first."""
+    if hint < len(rows) and (rows[hint].get("name") or f"row_{hint}") == row_key:
+        return hint
+    for idx, row in enumerate(rows):
+        if (row.get("name") or f"row_{idx}") == row_key:
+            return idx
+    return None
+
 
 async def async_setup_entry(
     hass: HomeAssistant,
@@ -42,33 +63,36 @@ async def async_setup_entry(
     entry_data = hass.data[DOMAIN][entry.entry_id]
     api = entry_data["api"]
     config = entry_data["config"]
-    rows_data = entry_data.get("rows_data", [])
 
     _LOGGER.debug("Entry data loaded - Config: %s", config)
-    _LOGGER.debug("Rows data loaded - Length: %d", len(rows_data))
+
+    # I layer WFS sono gestiti dalla piattaforma device_tracker
+    if config.get("resource_format") == "WFS":
+        return
 
     async def async_update_data():
         """Fetch data from API."""
-        try:
-            url = config.get("resource_url")
-            if not url:
-                _LOGGER.error("No resource URL found in config")
-                return rows_data
+        url = config.get("resource_url")
+        if not url:
+            raise UpdateFailed("No resource URL found in config")
 
-            _LOGGER.debug("Fetching data from URL: %s", url)
+        _LOGGER.debug("Fetching data from URL: %s", url)
+        try:
             data = await api.get_resource_data(url)
+        except CannotConnect as err:
+            raise UpdateFailed(f"Error fetching data: {err}") from err
 
-            if isinstance(data, dict) and "rows" in data:
-                return data["rows"]
-            elif isinstance(data, list):
-                return data
+        # Caso più comune per primo: la risorsa è già una lista di righe
+        if isinstance(data, list):
+            rows = data
+        elif isinstance(data, dict) and data.get("rows") is not None:
+            rows = data["rows"]
+        else:
+            raise UpdateFailed("Unexpected data format received")
 
-            _LOGGER.warning("Unexpected data format received")
-            return rows_data
-
-        except Exception as err:
-            _LOGGER.error("Error fetching data: %s", err)
-            return rows_data
+        if not rows:
+            raise UpdateFailed("No rows received from resource")
+        return rows
 
     coordinator = DataUpdateCoordinator(
         hass,
@@ -78,35 +102,44 @@ async def async_setup_entry(
         update_interval=timedelta(seconds=DEFAULT_SCAN_INTERVAL),
     )
 
-    # Imposta i dati iniziali nel coordinator
-    coordinator.data = rows_data
+    # Le righe non vengono salvate nella config entry: le scarica al setup
+    await coordinator.async_config_entry_first_refresh()
+    rows_data = coordinator.data
+    _LOGGER.debug("Rows data loaded - Length: %d", len(rows_data))
 
     entities = []
     selected_rows = config.get("selected_rows", [])
+    selected_row_names = config.get("selected_row_names", ())
     selected_fields = config.get("selected_fields", [])
 
     _LOGGER.debug("Creating sensors for rows: %s", selected_rows)
     _LOGGER.debug("With fields: %s", selected_fields)
 
     # Crea un sensore per ogni campo selezionato di ogni riga selezionata
-    for row_idx in selected_rows:
-        if row_idx >= len(rows_data):
+    for position, row_idx in enumerate(selected_rows):
+        unique_row_idx = row_idx
+        row_key = None
+        if position < len(selected_row_names):
+            row_key = selected_row_names[position]
+            row_idx = _find_row(rows_data, row_key, row_idx)
+
+        if row_idx is None or row_idx >= len(rows_data):
             _LOGGER.error(
-                "Row index %d out of range (total rows: %d)", row_idx, len(rows_data))
+                "Row %s not found (total rows: %d)", row_key or row_idx, len(rows_data))
             continue
 
         row = rows_data[row_idx]
         row_name = row.get("name", f"row_{row_idx}")
+        # Indice per codice della riga (vince la prima occorrenza)
+        measurements_by_code = {}
+        for measurement in row.get("measurements", []):
+            measurements_by_code.setdefault(measurement.get("code", "").lower(), measurement)
 
         for field_type, key in selected_fields:
             try:
                 if field_type == "measurement":
                     # Cerca la misurazione con il codice corrispondente
-                    measurement = next(
-                        (m for m in row.get("measurements", [])
-                         if m.get("code", "").lower() == key.lower()),
-                        None
-                    )
+                    measurement = measurements_by_code.get(key.lower())
                     if measurement:
                         _LOGGER.debug(
                             "Creating measurement sensor: %s - %s",
@@ -120,7 +153,9 @@ async def async_setup_entry(
                             key,
                             row_name,
                             measurement.get("description", key),
-                            field_type
+                            field_type,
+                            unique_row_idx,
+                            row_key
                         )
                         entities.append(sensor)
                 else:
@@ -136,7 +171,9 @@ async def async_setup_entry(
                         key,
                         row_name,
                         key,
-                        field_type
+                        field_type,
+                        unique_row_idx,
+                        row_key
                     )
                     entities.append(sensor)
             except Exception as err:
@@ -173,28 +210,30 @@ class OpenDataSensor(CoordinatorEntity, SensorEntity):
         field: str,
         row_name: str,
         description: str,
-        field_type: str
+        field_type: str,
+        unique_row_idx: int | None = None,
+        row_key: str | None = None
     ) -> None:
         """Initialize the sensor."""
         super().__init__(coordinator)
         self._row_idx = row_idx
+        # Nome della riga: la posizione viene ricalcolata se i dati cambiano ordine
+        self._row_key = row_key
+        self._rows_seen = coordinator.data
         self._field = field
         self._field_type = field_type
         self._config_entry = config_entry
 
-        # Genera l'ID univoco
+        # Genera l'ID univoco (sulla posizione configurata, stabile anche se la riga si sposta)
+        if unique_row_idx is None:
+            unique_row_idx = row_idx
         self._attr_unique_id = (
-            f"{config_entry.entry_id}_{row_idx}_{field_type}_{field}"
+            f"{config_entry.entry_id}_{unique_row_idx}_{field_type}_{field}"
         )
 
         # Crea nomi puliti per l'entity_id
-        clean_row_name = re.sub(r'[^a-z0-9_]+', '_', row_name.lower().strip())
-        clean_description = re.sub(
-            r'[^a-z0-9_]+', '_', description.lower().strip())
-
-        # Rimuovi underscore multipli e trim
-        clean_row_name = re.sub(r'_+', '_', clean_row_name).strip('_')
-        clean_description = re.sub(r'_+', '_', clean_description).strip('_')
+        clean_row_name = _slugify(row_name)
+        clean_description = _slugify(description)
 
         self.entity_id = f"sensor.provbz_{clean_row_name}_{clean_description}"
         self._attr_name = f"{row_name} {description}"
@@ -209,43 +248,41 @@ class OpenDataSensor(CoordinatorEntity, SensorEntity):
             self._attr_unique_id
         )
 
-    @property
-    def native_value(self) -> Any:
-        """Return the state of the sensor."""
-        if not self.coordinator.data:
+    def _current_row(self) -> dict | None:
+        """Return the configured row from the latest coordinator data."""
+        rows = self.coordinator.data
+        if not rows:
             return None
 
-        try:
-            if self._row_idx >= len(self.coordinator.data):
-                return None
+        if rows is not self._rows_seen:
+            self._rows_seen = rows
+            if self._row_key is not None:
+                self._row_idx = _find_row(rows, self._row_key, self._row_idx or 0)
 
-            row = self.coordinator.data[self._row_idx]
-            return row.get(self._field)
-        except (IndexError, KeyError):
+        if self._row_idx is None or self._row_idx >= len(rows):
             return None
+        return rows[self._row_idx]
+
+    @property
+    def native_value(self) -> Any:
+        """Return the state of the sensor."""
+        row = self._current_row()
+        if row is None:
+            return None
+        return row.get(self._field)
 
     @property
     def extra_state_attributes(self) -> dict[str, Any]:
         """Return the state attributes."""
-        if not self.coordinator.data:
-            return {}
-
-        try:
-            row = self.coordinator.data[self._row_idx]
-            return {
-                k: v for k, v in row.items()
-                if k != self._field and k != "measurements"
-            }
-        except (IndexError, KeyError):
+        row = self._current_row()
+        if row is None:
             return {}
+        return {
+            k: v for k, v in row.items()
+            if k != self._field and k != "measurements"
+        }
 
     @property
     def available(self) -> bool:
         """Return if entity is available."""
-        if not self.coordinator.data:
-            return False
-
-        try:
-            return self._row_idx < len(self.coordinator.data)
-        except:
-            return False
+        return self._current_row() is not None